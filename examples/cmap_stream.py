@@ -0,0 +1,89 @@
+import sys
+sys.path.insert(0,'..')
+
+from mplkit.cmap import *
+import os
+import shutil
+import tempfile
+import numpy as np
+import matplotlib
+import matplotlib.image
+from matplotlib.colors import Normalize
+
+cmap = matplotlib.cm.viridis
+rev_cmap = ReversedColormap(cmap)
+norm = Normalize(vmin=-1, vmax=1)
+
+tmp = tempfile.mkdtemp()
+try:
+	# A field whose sides are not multiples of the tile size, and whose last
+	# band of tiles has an odd height.
+	rows, cols, tile_size = 1001, 777, 128
+	data = np.memmap(os.path.join(tmp, 'data.f32'), dtype=np.float32, mode='w+', shape=(rows, cols))
+	data[:] = np.sin(np.arange(rows)[:, None] / 50.) * np.cos(np.arange(cols)[None, :] / 30.)
+	expected = rev_cmap(norm(np.asarray(data)), bytes=True)
+
+	# Memmapped uint8 output, from tiled memmap input and from a row block iterator.
+	for source in [data, (data[i:i+97] for i in range(0, rows, 97))]:
+		out = np.memmap(os.path.join(tmp, 'out.rgba'), dtype=np.uint8, mode='w+', shape=(rows, cols, 4))
+		stream_colormap(rev_cmap, source, vmin=-1, vmax=1, out=out, tile_size=tile_size)
+		assert(np.array_equal(out, expected))
+	print("Streamed array output matches rev_cmap(norm(data), bytes=True).")
+
+	# Wrappers that do not support `bytes=True` themselves are evaluated as
+	# floats, and converted to opaque bytes.
+	for wrapped in [InvertedColormap(cmap), DesaturatedColormap(cmap)]:
+		out = np.empty((rows, cols, 4), dtype=np.uint8)
+		stream_colormap(wrapped, data, vmin=-1, vmax=1, out=out, tile_size=tile_size)
+		assert(np.array_equal(out, np.clip(wrapped(norm(np.asarray(data))) * 255, 0, 255).astype(np.uint8)))
+		assert(np.all(out[..., -1] == 255))
+	print("Inverted and desaturated colormaps stream correctly.")
+
+	# Mismatched outputs are rejected.
+	for kwargs in [dict(out=np.empty((rows+1, cols, 4), dtype=np.uint8)), dict(out=out, levels=2)]:
+		try:
+			stream_colormap(rev_cmap, data, vmin=-1, vmax=1, **kwargs)
+		except AssertionError:
+			pass
+		else:
+			raise RuntimeError("Expected stream_colormap to reject %s." % list(kwargs))
+
+	# Masked values from a row block iterator get the "bad" colour.
+	masked = np.ma.masked_greater(np.asarray(data), 0.9)
+	out = np.empty((rows, cols, 4), dtype=np.uint8)
+	stream_colormap(rev_cmap, (masked[i:i+97] for i in range(0, rows, 97)), vmin=-1, vmax=1, out=out)
+	assert(np.array_equal(out, rev_cmap(norm(masked), bytes=True)))
+	assert(np.all(out[masked.mask] == rev_cmap(np.ma.masked_all(1), bytes=True)[0]))
+	print("Masked values are given the bad colour.")
+
+	# PNG tile pyramids, for even and odd tile sizes; tiled and row block input
+	# must give identical tiles at every level.
+	levels = 4
+	for tile_size in [128, 75]:
+		tiles = os.path.join(tmp, 'tiles')
+		rows_tiles = os.path.join(tmp, 'row_tiles')
+		stream_colormap(rev_cmap, data, vmin=-1, vmax=1, directory=tiles, tile_size=tile_size, levels=levels)
+		stream_colormap(rev_cmap, (data[i:i+97] for i in range(0, rows, 97)), vmin=-1, vmax=1, directory=rows_tiles, tile_size=tile_size, levels=levels)
+
+		level_rows, level_cols = rows, cols
+		for level in range(levels):
+			n_rows = -(-level_rows // tile_size)
+			n_cols = -(-level_cols // tile_size)
+			names = sorted(os.listdir(os.path.join(tiles, str(level))))
+			assert(names == sorted(os.listdir(os.path.join(rows_tiles, str(level)))))
+			assert(len(names) == n_rows * n_cols)
+			for i in range(n_rows):
+				for j in range(n_cols):
+					name = '%d_%d.png' % (i, j)
+					tile = matplotlib.image.imread(os.path.join(tiles, str(level), name))
+					assert(tile.shape == (min(tile_size, level_rows - i*tile_size), min(tile_size, level_cols - j*tile_size), 4))
+					assert(np.array_equal(tile, matplotlib.image.imread(os.path.join(rows_tiles, str(level), name))))
+			if level == 0:
+				full = np.vstack([np.hstack([matplotlib.image.imread(os.path.join(tiles, '0', '%d_%d.png' % (i, j))) for j in range(n_cols)]) for i in range(n_rows)])
+				assert(np.array_equal(np.round(full * 255).astype(np.uint8), expected))
+			level_rows, level_cols = (level_rows + 1) // 2, (level_cols + 1) // 2
+		shutil.rmtree(tiles)
+		shutil.rmtree(rows_tiles)
+	print("Tile pyramids have the expected tile counts and sizes.")
+finally:
+	shutil.rmtree(tmp)
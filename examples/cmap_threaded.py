@@ -0,0 +1,38 @@
+import sys
+sys.path.insert(0,'..')
+
+from mplkit.cmap import *
+import time
+import numpy as np
+import matplotlib
+
+cmap = matplotlib.cm.Blues
+inv_cmap = InvertedColormap(ReversedColormap(cmap))
+
+# Check that chunked evaluation matches serial evaluation exactly, including
+# chunk sizes that do not divide the input, non-contiguous input and
+# per-pixel alpha.
+X = np.random.rand(301, 257)
+alpha = np.random.rand(301, 257)
+for data, a in [(X, None), (X.T, None), (X[::3, ::2], None), (X, 0.5), (X, alpha), (X.T, alpha.T), (X, np.asfortranarray(alpha))]:
+	for chunk_size in [1, 1000, 4099, 10**6]:
+		for bytes in [False, True]:
+			serial = inv_cmap(data, alpha=a, bytes=bytes)
+			threaded = inv_cmap.threaded(data, alpha=a, bytes=bytes, chunk_size=chunk_size)
+			assert(threaded.dtype == serial.dtype and np.array_equal(threaded, serial))
+print("Threaded output matches serial output.")
+
+# Benchmark on a 100 megapixel input.
+X = np.random.rand(10000, 10000).astype(np.float32)
+
+start = time.time()
+serial = inv_cmap(X, bytes=True)
+serial_time = time.time() - start
+print("serial: %.2fs" % serial_time)
+
+for threads in [1, 2, 4, 8]:
+	start = time.time()
+	threaded = inv_cmap.threaded(X, bytes=True, threads=threads)
+	elapsed = time.time() - start
+	assert(np.array_equal(threaded, serial))
+	print("%d threads: %.2fs (%.1fx)" % (threads, elapsed, serial_time / elapsed))
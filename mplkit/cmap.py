@@ -1,7 +1,10 @@
+import os
 import matplotlib
-from matplotlib.colors import Colormap, LinearSegmentedColormap, ListedColormap
+import matplotlib.image
+from matplotlib.colors import Colormap, LinearSegmentedColormap, ListedColormap, Normalize
 
 import numpy as np
+from multiprocessing.pool import ThreadPool
 
 class WrappedColormap(Colormap):
 	"""
@@ -49,6 +52,77 @@ class WrappedColormap(Colormap):
 
 		return get_luma(color)
 
+	def threaded(self, X, alpha=None, bytes=False, threads=None, chunk_size=2**16, pool=None):
+		"""
+		Evaluate the colormap on `X` as `__call__` would, but split the input
+		into chunks of about `chunk_size` values and map them onto a pool of
+		worker threads. Results are written into a single preallocated output
+		array. Non-array input is passed straight through to `__call__`.
+
+		 - alpha : None, a scalar, or an array of the same shape as `X`; which is
+		 	split into chunks alongside `X`.
+		 - threads : None (default) or positive integer. The number of worker
+		 	threads; None uses one per CPU. Ignored if `pool` is given.
+		 - pool : None (default) or a `multiprocessing.pool.ThreadPool` to reuse
+		 	across calls; it is left open.
+
+		If `X` (and any array `alpha`) is C-contiguous, it is chunked through a
+		flat view; otherwise (transposed arrays, strided memmap views) it is
+		chunked along its leading axis, so that neither is copied as a whole.
+
+		Threads only help where the wrapped colormaps spend their time in
+		NumPy kernels that release the GIL. `ConcatenatedColormap` evaluates
+		each pixel in Python via `np.vectorize`, so chains containing it gain
+		nothing from `threaded` beyond the pool overhead.
+		"""
+		if not isinstance(X, np.ndarray) or X.ndim == 0:
+			return self(X, alpha=alpha, bytes=bytes)
+		assert(chunk_size > 0)
+
+		alpha_chunked = alpha is not None and np.ndim(alpha) > 0
+		if alpha_chunked:
+			alpha = np.asanyarray(alpha)
+			if alpha.shape != X.shape:
+				raise ValueError("alpha must be a scalar or an array of the same shape as X; got shape %s for X of shape %s." % (alpha.shape, X.shape))
+
+		if X.flags.c_contiguous and (not alpha_chunked or alpha.flags.c_contiguous):
+			src = X.reshape(-1)
+			alpha_src = alpha.reshape(-1) if alpha_chunked else alpha
+			step = chunk_size
+		else:
+			src = X
+			alpha_src = alpha
+			step = max(1, chunk_size // max(1, int(np.prod(X.shape[1:]))))
+
+		def get_alpha(start):
+			return alpha_src[start:start+step] if alpha_chunked else alpha
+
+		# Lookup tables are initialised lazily on first use, which is not safe
+		# to race; so initialise them all (including those of any sub-maps)
+		# before the workers start. The first chunk is evaluated serially to
+		# fix the output dtype.
+		self._init()
+		first = np.asarray(self(src[:step], alpha=get_alpha(0), bytes=bytes))
+		out = np.empty(src.shape + first.shape[src.ndim:], dtype=first.dtype)
+		out[:first.shape[0]] = first
+
+		def apply(start):
+			out[start:start+step] = self(src[start:start+step], alpha=get_alpha(start), bytes=bytes)
+
+		starts = list(range(step, src.shape[0], step))
+		if len(starts) > 0:
+			if pool is not None:
+				pool.map(apply, starts)
+			else:
+				pool = ThreadPool(threads)
+				try:
+					pool.map(apply, starts)
+				finally:
+					pool.close()
+					pool.join()
+
+		return out.reshape(X.shape + out.shape[src.ndim:])
+
 class ReversedColormap(WrappedColormap):
 	'Reverses the color map.'
 
@@ -156,3 +230,179 @@ class ConcatenatedColormap(WrappedColormap):
 			return np.average(c,axis=-1,weights=[0.299,0.587,0.114,0])
 
 		return get_luma(color)
+
+def stream_colormap(cmap, data, vmin, vmax, out=None, directory=None, tile_size=256, levels=1, threads=None):
+	"""
+	`stream_colormap` applies `cmap` to a 2D scalar field too large to hold in
+	memory, writing the RGBA result incrementally. Values are normalised with
+	the fixed `vmin` and `vmax` so that every chunk is coloured consistently,
+	and the colormap is evaluated with `WrappedColormap.threaded` on a single
+	thread pool of `threads` workers (None uses one per CPU). Colours are
+	computed as floats and converted to bytes afterwards, so that every
+	wrapper in `mplkit.cmap` may be used. Masked values are given the
+	colormap's "bad" colour.
+
+	`data` may be either:
+	 - a 2D array (typically a `numpy.memmap`), which is read in
+	 	`tile_size` x `tile_size` tiles; or
+	 - an iterable of 2D row blocks of equal width (which may be masked
+	 	arrays), which are coloured one block at a time.
+
+	Exactly one of the following outputs must be given:
+	 - out : an array-like of dtype uint8 and shape (rows, columns, 4) (such
+	 	as a `numpy.memmap`), into which the colours are written as they are
+	 	computed.
+	 - directory : the name of a directory into which `tile_size` x `tile_size`
+	 	PNG tiles are written as `<directory>/<level>/<row>_<col>.png`, with level
+	 	0 at full resolution and each of the subsequent `levels`-1 levels
+	 	downsampled by a factor of two. `levels` > 1 requires `directory`.
+
+	For 2D array input, memory use is independent of the image size: tiles
+	are coloured one at a time, and the pyramid is built depth-first (each
+	tile from its four children at the level below), so that at most four
+	tiles per level are held at once. For iterator input, memory grows with
+	the size of the blocks yielded; and a pyramid additionally buffers up
+	to `tile_size` rows of the full (downsampled) width at each level.
+
+	`out` or `directory` is returned.
+	"""
+	assert((out is None) != (directory is None))
+	assert(tile_size > 0 and levels > 0)
+	assert(levels == 1 or directory is not None)
+	if not isinstance(cmap, WrappedColormap):
+		cmap = WrappedColormap(cmap)
+	norm = Normalize(vmin=vmin, vmax=vmax)
+
+	pool = ThreadPool(threads)
+	try:
+		def colour(block):
+			rgba = cmap.threaded(norm(block), pool=pool)
+			return np.clip(np.asarray(rgba) * 255, 0, 255).astype(np.uint8)
+
+		if hasattr(data, 'shape') and len(data.shape) == 2:
+			if out is not None:
+				_stream_array(colour, data, out, tile_size)
+			else:
+				_stream_pyramid(colour, data, directory, tile_size, levels)
+		else:
+			writer = _ArrayWriter(out) if out is not None else _TileWriter(directory, tile_size, levels)
+			for block in data:
+				assert(np.ndim(block) == 2)
+				writer.push(colour(block))
+			writer.flush()
+	finally:
+		pool.close()
+		pool.join()
+
+	return out if out is not None else directory
+
+def _stream_array(colour, data, out, tile_size):
+	rows, cols = data.shape
+	assert(out.shape == (rows, cols, 4))
+	for r in range(0, rows, tile_size):
+		for c in range(0, cols, tile_size):
+			out[r:r+tile_size, c:c+tile_size] = colour(data[r:r+tile_size, c:c+tile_size])
+	if hasattr(out, 'flush'):
+		out.flush()
+
+def _stream_pyramid(colour, data, directory, tile_size, levels):
+	# The number of rows and columns of pixels at each level.
+	shapes = [data.shape]
+	for level in range(1, levels):
+		shapes.append(((shapes[-1][0]+1)//2, (shapes[-1][1]+1)//2))
+	directories = [_level_directory(directory, level) for level in range(levels)]
+
+	def render(level, i, j):
+		# Tile (i, j) of a level covers pixels [2*i*t, 2*(i+1)*t) of the level
+		# below, which are exactly the tiles (2i:2i+2, 2j:2j+2) there.
+		if level == 0:
+			rgba = colour(data[i*tile_size:(i+1)*tile_size, j*tile_size:(j+1)*tile_size])
+		else:
+			rows, cols = shapes[level-1]
+			children = [
+				np.concatenate([render(level-1, ci, cj) for cj in (2*j, 2*j+1) if cj*tile_size < cols], axis=1)
+				for ci in (2*i, 2*i+1) if ci*tile_size < rows
+			]
+			rgba = _downsample(np.concatenate(children, axis=0))
+		matplotlib.image.imsave(os.path.join(directories[level], '%d_%d.png' % (i, j)), rgba)
+		return rgba
+
+	rows, cols = shapes[-1]
+	for i in range(0, -(-rows // tile_size)):
+		for j in range(0, -(-cols // tile_size)):
+			render(levels-1, i, j)
+
+def _level_directory(directory, level):
+	level_directory = os.path.join(directory, str(level))
+	if not os.path.isdir(level_directory):
+		os.makedirs(level_directory)
+	return level_directory
+
+def _downsample(rgba):
+	# Pad odd edges by repeating the last row/column, then average 2x2 blocks.
+	if rgba.shape[0] % 2:
+		rgba = np.concatenate((rgba, rgba[-1:]), axis=0)
+	if rgba.shape[1] % 2:
+		rgba = np.concatenate((rgba, rgba[:, -1:]), axis=1)
+	rgba = rgba.astype(float)
+	rgba = (rgba[0::2, 0::2] + rgba[1::2, 0::2] + rgba[0::2, 1::2] + rgba[1::2, 1::2]) / 4
+	return np.round(rgba).astype(np.uint8)
+
+class _ArrayWriter(object):
+
+	def __init__(self, out):
+		self.out = out
+		self.row = 0
+
+	def push(self, rgba):
+		assert(rgba.shape[1:] == self.out.shape[1:])
+		self.out[self.row:self.row+rgba.shape[0]] = rgba
+		self.row += rgba.shape[0]
+
+	def flush(self):
+		assert(self.row == self.out.shape[0])
+		if hasattr(self.out, 'flush'):
+			self.out.flush()
+
+class _TileWriter(object):
+	"""
+	Writes full width bands of rows as PNG tiles at one level of a pyramid,
+	passing each band on, downsampled, to the writer of the next level.
+	"""
+
+	def __init__(self, directory, tile_size, levels, level=0):
+		self.directory = _level_directory(directory, level)
+		self.tile_size = tile_size
+		self.tile_row = 0
+		self.buffer = None
+		self.carry = None # An unpaired row, awaiting the next band before downsampling
+		self.next = _TileWriter(directory, tile_size, levels, level+1) if level < levels-1 else None
+
+	def push(self, rgba):
+		self.buffer = rgba if self.buffer is None else np.concatenate((self.buffer, rgba))
+		while self.buffer.shape[0] >= self.tile_size:
+			self._write(self.buffer[:self.tile_size])
+			self.buffer = self.buffer[self.tile_size:]
+
+	def flush(self):
+		if self.buffer is not None and self.buffer.shape[0] > 0:
+			self._write(self.buffer)
+		self.buffer = None
+		if self.next is not None:
+			if self.carry is not None and self.carry.shape[0] > 0:
+				self.next.push(_downsample(self.carry))
+			self.carry = None
+			self.next.flush()
+
+	def _write(self, band):
+		for j, col in enumerate(range(0, band.shape[1], self.tile_size)):
+			path = os.path.join(self.directory, '%d_%d.png' % (self.tile_row, j))
+			matplotlib.image.imsave(path, band[:, col:col+self.tile_size])
+		self.tile_row += 1
+		if self.next is not None:
+			if self.carry is not None:
+				band = np.concatenate((self.carry, band))
+			paired = band.shape[0] - band.shape[0] % 2
+			self.carry = band[paired:]
+			if paired > 0:
+				self.next.push(_downsample(band[:paired]))